@@ -2,12 +2,14 @@ import asyncio
 import websockets
 import logging
 
-from typing import Optional, Callable
+from typing import Optional, Callable, Set
 
 from .sttutil import STTUtil
 from .wsclient import Client
 
 from .driver import Driver, default_driver
+from .stream import Hub
+from .matcher import Matcher
 from config.settings import DOUYU_CONFIG, BARRAGE_MESSAGE_TYPE
 
 logger = logging.getLogger("crawler.roomclient")
@@ -33,6 +35,9 @@ class RoomClient:
         message_type: str = BARRAGE_MESSAGE_TYPE,
         table_prefix: str = BARRAGE_MESSAGE_TYPE,
         heartbeat_interval: int = 60,
+        hub: Optional[Hub] = None,
+        matcher: Optional[Matcher] = None,
+        tagged: Optional[Set[str]] = None,
     ):
         self.room_id = room_id
         self.login_msg = STTUtil.stt_render(
@@ -53,12 +58,17 @@ class RoomClient:
 
         self._wsclient = Client()
         self._driver = driver
+        self._hub = hub
+        self._matcher = matcher
+        # tables with a tags column, shared with the manager that upgrades them
+        self._tagged = tagged if tagged is not None else set()
         self._table = f"{table_prefix}_{room_id}"
 
         self._lock = asyncio.Lock()  # lock for atomic operation
         self._pausing: Optional[asyncio.Future] = None
         self._running: Optional[asyncio.Future] = None
         self._closed: bool = False
+        self._backoff: Optional[asyncio.Task] = None
         self._heartbeat = heartbeat_interval
 
         self._main_task: Optional[asyncio.Task] = None
@@ -79,12 +89,19 @@ class RoomClient:
             #     map(STTUtil.stt_parses, STTUtil.unpack_from(frame))
             # )
             # print(raw_msgs)
-            msgs = filter(
-                lambda m: m.get("type", None) == self.message_type,
-                map(STTUtil.stt_parse, STTUtil.unpack_from(frame)),
+            msgs = list(
+                filter(
+                    lambda m: m.get("type", None) == self.message_type,
+                    map(STTUtil.stt_parse, STTUtil.unpack_from(frame)),
+                )
             )
             if msgs:
-                await self._driver.save_jsons(msgs, self._table)
+                tags = None
+                if self._matcher is not None and self._table in self._tagged:
+                    tags = list(map(self._matcher.tag, msgs))
+                if self._hub is not None:
+                    self._hub.publish(self.room_id, msgs)
+                await self._driver.save_jsons(msgs, self._table, tags)
         return await self._logout()
 
     async def _keep_alive(self) -> None:
@@ -97,7 +114,12 @@ class RoomClient:
             return await self._login() and await self._join_group()
 
     async def _prepare(self) -> bool:
-        return await self._driver.create_json_table(self._table)
+        if not await self._driver.create_json_table(self._table):
+            return False
+        # older tables get the column from the manager in the background
+        if "tags" in await self._driver.table_columns(self._table):
+            self._tagged.add(self._table)
+        return True
 
     async def _disconnect(self) -> bool:
         return await self._wsclient.close()
@@ -110,6 +132,15 @@ class RoomClient:
                 logging.info(f"Paused. Room ID { self.room_id }")
                 await self._pausing
 
+            # every endpoint is cooling down, back off outside the lock
+            delay = self._wsclient.retry_after()
+            if delay > 0:
+                logging.info(f"Backing off {delay:.1f}s. Room ID { self.room_id }")
+                self._backoff = asyncio.create_task(asyncio.sleep(delay))
+                await asyncio.wait([self._backoff])  # cancelled by stop()
+                self._backoff = None
+                continue
+
             # init connection(atomic operation)
             async with self._lock:
                 if self._closed:
@@ -154,6 +185,8 @@ class RoomClient:
     async def stop(self) -> bool:
         if not self._closed:
             self._closed = True
+            if self._backoff is not None:
+                self._backoff.cancel()
             async with self._lock:
                 # do not disconnect during initialization
                 await self._disconnect()
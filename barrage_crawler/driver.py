@@ -2,7 +2,7 @@ import asyncpg
 import logging
 import rapidjson
 from datetime import datetime, timezone, timedelta
-from typing import List, Tuple, Iterable
+from typing import List, Tuple, Iterable, Optional, Set
 
 from config.settings import POSTGRES
 
@@ -50,9 +50,9 @@ class Driver:
             logger.debug(f"SQL: {query}")
             logger.debug(f"ARGS: {str(args)}")
             if single:
-                return await self._pool.fetchrow(query, args)
+                return await self._pool.fetchrow(query, *args)
             else:
-                return await self._pool.fetch(query, args)
+                return await self._pool.fetch(query, *args)
         except Exception as e:
             logger.exception(str(e), exc_info=True)
             return None
@@ -72,7 +72,8 @@ class Driver:
             userid varchar(20) NOT NULL,
             nickname varchar(100) NOT NULL,
             time timestamptz,
-            chatmsg jsonb NOT NULL
+            chatmsg jsonb NOT NULL,
+            tags integer[]
             );
         """
         try:
@@ -84,30 +85,143 @@ class Driver:
         else:
             return True
 
-    async def save_json(self, data: dict, table: str) -> bool:
-        query = f"""
-            INSERT INTO "{table}" (userid, nickname, time, chatmsg) VALUES ($1, $2, $3, $4);
+    async def add_tags_column(self, table: str) -> bool:
+        # tables created before keyword tagging have no tags column,
+        # check first: ALTER takes an exclusive lock even if it exists
+        if "tags" not in await self.table_columns(table):
+            query = f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS tags integer[];'
+            try:
+                logger.debug(f"SQL: {query}")
+                async with self._pool.acquire() as conn:
+                    async with conn.transaction():
+                        # give up rather than queue all reads behind the lock
+                        await conn.execute("SET LOCAL lock_timeout = '5s';")
+                        await conn.execute(query)
+            except Exception as e:
+                logger.error(str(e))
+                return False
+        return True
+
+    async def create_tags_index(self, table: str) -> bool:
+        return await self.create_index(f"{table}_tags_idx", f'"{table}" USING gin (tags)')
+
+    async def create_json_indexes(self, table: str) -> bool:
+        # keyset pagination needs (time, id) and must not depend on pg_trgm
+        if not await self.create_index(
+            f"{table}_time_id_idx", f'"{table}" (time, id)'
+        ):
+            return False
+        try:
+            query = "CREATE EXTENSION IF NOT EXISTS pg_trgm;"
+            logger.debug(f"SQL: {query}")
+            await self._pool.execute(query)
+        except Exception as e:
+            logger.error(f"pg_trgm unavailable, text search is not indexed: {e}")
+            return False
+        return await self.create_index(
+            f"{table}_txt_trgm_idx",
+            f"\"{table}\" USING gin ((chatmsg->>'txt') gin_trgm_ops)",
+        )
+
+    async def create_index(self, name: str, definition: str) -> bool:
+        # an interrupted concurrent build (cancelled, worker killed) leaves an
+        # invalid index behind, which IF NOT EXISTS would accept as is
+        record = await self.select(
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1);",
+            (f'"{name}"',),
+            single=True,
+        )
+        if record is not None and not record["indisvalid"]:
+            logger.warning(f"Dropping invalid index {name}")
+            try:
+                await self._pool.execute(
+                    f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";'
+                )
+            except Exception as e:
+                logger.error(str(e))
+                return False
+        # CONCURRENTLY cannot run inside a transaction, so execute one by one
+        query = f'CREATE INDEX CONCURRENTLY IF NOT EXISTS "{name}" ON {definition};'
+        try:
+            logger.debug(f"SQL: {query}")
+            await self._pool.execute(query)
+        except Exception as e:
+            logger.error(str(e))
+            # drop the invalid index left by the failed build right away
+            try:
+                await self._pool.execute(
+                    f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";'
+                )
+            except Exception as e:
+                logger.error(str(e))
+            return False
+        else:
+            return True
+
+    async def list_tables(self, prefix: str) -> List[str]:
+        query = """
+            SELECT tablename FROM pg_tables
+            WHERE schemaname = current_schema() AND tablename LIKE $1;
         """
+        records = await self.select(query, (self.escape_like(prefix) + "\\_%",))
+        return [r["tablename"] for r in records or []]
+
+    async def table_columns(self, table: str) -> Set[str]:
+        query = """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = $1;
+        """
+        records = await self.select(query, (table,))
+        return {r["column_name"] for r in records or []}
+
+    async def save_json(
+        self, data: dict, table: str, tags: Optional[List[int]] = None
+    ) -> bool:
+        query = self._insert_query(table, tags is not None)
         try:
             logger.debug(f"SQL: {query}")
             logger.debug(f"ARGS: {str(data)}")
-            await self._pool.execute(query, self.generate_json_args(data))
+            args = self.generate_json_args(data, tags)
+            await self._pool.execute(query, *(args if tags is not None else args[:4]))
         except Exception as e:
             logger.error(str(e))
 
-    async def save_jsons(self, datas: Iterable[dict], table: str) -> bool:
-        query = f"""
-            INSERT INTO "{table}" (userid, nickname, time, chatmsg) VALUES ($1, $2, $3, $4);
-        """
+    async def save_jsons(
+        self,
+        datas: Iterable[dict],
+        table: str,
+        tags: Optional[Iterable[Optional[List[int]]]] = None,
+    ) -> bool:
+        # without tags, also works on tables that have not been upgraded yet
+        query = self._insert_query(table, tags is not None)
         try:
             logger.debug(f"SQL: {query}")
             logger.debug(f"ARGS: {str(datas)}")
-            args = map(self.generate_json_args, datas)
+            if tags is not None:
+                args = map(self.generate_json_args, datas, tags)
+            else:
+                args = (a[:4] for a in map(self.generate_json_args, datas))
             await self._pool.executemany(query, args)
         except Exception as e:
             logger.error(str(e))
 
-    def generate_json_args(self, data: dict) -> Tuple[str, str, datetime, dict]:
+    @staticmethod
+    def _insert_query(table: str, tagged: bool) -> str:
+        if tagged:
+            return f"""
+                INSERT INTO "{table}" (userid, nickname, time, chatmsg, tags) VALUES ($1, $2, $3, $4, $5);
+            """
+        return f"""
+            INSERT INTO "{table}" (userid, nickname, time, chatmsg) VALUES ($1, $2, $3, $4);
+        """
+
+    @staticmethod
+    def escape_like(s: str) -> str:
+        return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    def generate_json_args(
+        self, data: dict, tags: Optional[List[int]] = None
+    ) -> Tuple[str, str, datetime, dict, Optional[List[int]]]:
         userid = data["uid"]
         nickname = data["nn"]
         time = None
@@ -115,7 +229,7 @@ class Driver:
         if ts:
             timestamp = int(ts) if len(ts) == 10 else int(ts) / 1000
             time = datetime.fromtimestamp(timestamp, self.tz_utc_8)
-        return (userid, nickname, time, data)
+        return (userid, nickname, time, data, tags)
 
 
 default_driver = Driver(POSTGRES)
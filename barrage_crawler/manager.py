@@ -1,10 +1,14 @@
 import asyncio
 import logging
-from typing import List, Dict, AsyncGenerator, Any
+from typing import List, Dict, AsyncGenerator, Any, Optional, Set
 from asyncpg import Record
 
 from .driver import Driver, default_driver
 from .crawler import RoomClient
+from .server import Server
+from .stream import Hub
+from .matcher import Matcher
+from config.settings import BARRAGE_MESSAGE_TYPE
 
 logger = logging.getLogger("crawler.manager")
 
@@ -15,11 +19,24 @@ class Manager:
         rooms_table_name: str,
         json_field_name: str = "chatmsg",
         driver: Driver = default_driver,
+        server: Optional[Server] = None,
+        hub: Optional[Hub] = None,
+        matcher: Optional[Matcher] = None,
+        table_prefix: str = BARRAGE_MESSAGE_TYPE,
     ):
         self.__rooms_table__ = rooms_table_name
         self.__rooms_query__ = f'SELECT * FROM "{rooms_table_name}";'
         self.__json_field_name__ = json_field_name
         self._driver = driver
+        self._server = server
+        self._hub = hub
+        self._matcher = matcher
+        self._table_prefix = table_prefix
+
+        # tables with a tags column, shared with all room clients
+        self._tagged: Set[str] = set()
+        self._tags_indexed: Set[str] = set()
+        self._upgrade_task: Optional[asyncio.Task] = None
 
         self._clients: Dict[str, RoomClient] = {}
         self._loop = asyncio.get_event_loop()
@@ -34,16 +51,27 @@ class Manager:
             self._loop.run_until_complete(self.close())
 
     async def close(self) -> None:
+        if self._upgrade_task is not None:
+            self._upgrade_task.cancel()
         for room in self._clients.values():
             asyncio.create_task(room.stop())
+        if self._server is not None:
+            await self._server.stop()
 
     async def _main(self) -> None:
         logger.info("Starting room manager...")
         await self._driver.create_pool()
+        if self._server is not None:
+            await self._server.start()
         async for _ in poll():
             await self._poll_iteration()
 
     async def _poll_iteration(self) -> None:
+        if self._matcher is not None:
+            await self._matcher.reload()
+            # in the background, a slow index build must not hold up polling
+            if self._upgrade_task is None or self._upgrade_task.done():
+                self._upgrade_task = asyncio.create_task(self._upgrade_tables())
         room_records: List[Record] = await self._driver.select_all(
             self.__rooms_query__
         )
@@ -55,6 +83,8 @@ class Manager:
             if room_id not in room_record_ids:
                 room = self._clients.pop(room_id)
                 asyncio.create_task(room.stop())
+                if self._hub is not None:
+                    self._hub.clear(room_id)
         # Update & Add
         for room_record in room_records:
             r_id = room_record.get("room_id")
@@ -66,13 +96,31 @@ class Manager:
                 elif room.paused and not r_is_paused:
                     room.resume()
             else:
-                room = RoomClient(r_id)
+                room = RoomClient(
+                    r_id,
+                    table_prefix=self._table_prefix,
+                    hub=self._hub,
+                    matcher=self._matcher,
+                    tagged=self._tagged,
+                )
                 if r_is_paused:
                     room.pause()
                 self._clients[r_id] = room
                 asyncio.create_task(room.start())
         # print(self._clients)
 
+    async def _upgrade_tables(self) -> None:
+        # add the tags column and its index to tables from before keyword
+        # tagging; failures are retried on the next poll
+        for table in await self._driver.list_tables(self._table_prefix):
+            if table not in self._tagged:
+                if not await self._driver.add_tags_column(table):
+                    continue
+                self._tagged.add(table)
+            if table not in self._tags_indexed:
+                if await self._driver.create_tags_index(table):
+                    self._tags_indexed.add(table)
+
 
 async def poll(step: float = 10) -> AsyncGenerator[float, None]:
     loop = asyncio.get_event_loop()
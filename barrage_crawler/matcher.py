@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from config.settings import KEYWORD_CONFIG
+
+logger = logging.getLogger("crawler.matcher")
+
+
+class Automaton:
+    """Aho-Corasick automaton over lower-cased keywords.
+
+    Matching walks the text once, so its cost depends on the text length
+    and the number of hits, not on the number of keywords.
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[int, str]]):
+        goto: List[Dict[str, int]] = [{}]
+        out: List[list] = [[]]
+        for kw_id, word in keywords:
+            state = 0
+            for ch in word.lower():
+                nxt = goto[state].get(ch, None)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            if state:
+                out[state].append(kw_id)
+
+        # breadth first, so fail links always point to finished states
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt].extend(out[fail[nxt]])
+
+        self._goto = goto
+        self._fail = fail
+        self._out: List[Tuple[int, ...]] = [tuple(o) for o in out]
+
+    def match(self, text: str) -> set:
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        found = set()
+        for ch in text.lower():
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class Matcher:
+    """Tags barrage text with the ids of matching keywords and patterns.
+
+    The keyword file has one `<id>\\t<keyword>` entry per line, a keyword
+    starting with `re:` is compiled as a regular expression instead.
+    Each pattern costs a separate scan per message, so only the first
+    `max_patterns` are used. `reload` rebuilds everything when the file
+    has been modified.
+    """
+
+    REGEX_PREFIX = "re:"
+
+    def __init__(self, config: dict = KEYWORD_CONFIG):
+        self._path = config["path"]
+        self._max_patterns = config["max_patterns"]
+        self._mtime: Optional[float] = None
+        self._automaton = Automaton(())
+        self._patterns: List[Tuple[int, Pattern]] = []
+
+    async def reload(self) -> bool:
+        try:
+            mtime = os.stat(self._path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        # building tens of thousands of keywords takes a while,
+        # keep it off the event loop and swap when done
+        loop = asyncio.get_running_loop()
+        try:
+            automaton, patterns = await loop.run_in_executor(None, self._load)
+        except Exception as ex:
+            # keep tagging with the previous list, retried on the next poll
+            logger.exception(str(ex), exc_info=True)
+            logger.error(f"Failed to reload keywords from {self._path}")
+            return False
+        self._automaton, self._patterns = automaton, patterns
+        self._mtime = mtime
+        logger.info(f"Keywords reloaded from {self._path}")
+        return True
+
+    def _load(self) -> Tuple[Automaton, List[Tuple[int, Pattern]]]:
+        keywords = []
+        patterns = []
+        try:
+            with open(self._path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            lines = []
+        for line in lines:
+            if not line.strip() or line.startswith("#"):
+                continue
+            try:
+                kw_id, word = line.split("\t", 1)
+                if word.startswith(self.REGEX_PREFIX):
+                    if len(patterns) >= self._max_patterns:
+                        logger.warning(
+                            f"Skipping pattern {line!r}, "
+                            f"limited to {self._max_patterns} patterns"
+                        )
+                        continue
+                    patterns.append(
+                        (int(kw_id), re.compile(word[len(self.REGEX_PREFIX) :]))
+                    )
+                elif word:
+                    keywords.append((int(kw_id), word))
+            except (ValueError, re.error) as ex:
+                logger.warning(f"Invalid keyword entry {line!r}: {ex}")
+        return Automaton(keywords), patterns
+
+    def tag(self, msg: dict) -> Optional[List[int]]:
+        txt = msg.get("txt", None)
+        if not txt or not isinstance(txt, str):
+            return None
+        found = self._automaton.match(txt)
+        for kw_id, pattern in self._patterns:
+            if kw_id not in found and pattern.search(txt):
+                found.add(kw_id)
+        return sorted(found) if found else None
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import time
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, Optional, Set, Tuple
+
+from .driver import Driver, default_driver
+from config.settings import BARRAGE_MESSAGE_TYPE, QUERY_CONFIG
+
+logger = logging.getLogger("crawler.query")
+
+
+class TTLCache:
+    """Cache bounded by the total weight (rows) of its entries.
+
+    Every entry lives for the same TTL, so insertion order is expiry
+    order: expired entries are always at the front.
+    """
+
+    def __init__(self, ttl: float, maxweight: int):
+        self._ttl = ttl
+        self._maxweight = maxweight
+        self._weight = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, int, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self._data.get(key, None)
+        if item is None:
+            return None
+        expires, _, value = item
+        if expires < time.monotonic():
+            self._pop(key)
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any, weight: int = 1) -> None:
+        now = time.monotonic()
+        if key in self._data:
+            self._pop(key)
+        while self._data and next(iter(self._data.values()))[0] < now:
+            self._pop(next(iter(self._data)))
+        if weight > self._maxweight:
+            return
+        while self._weight + weight > self._maxweight:
+            self._pop(next(iter(self._data)))
+        self._data[key] = (now + self._ttl, weight, value)
+        self._weight += weight
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _pop(self, key: Hashable) -> None:
+        _, weight, _ = self._data.pop(key)
+        self._weight -= weight
+
+
+class QueryService:
+    RECHECK = 10.0  # seconds between tags column checks on untagged tables
+
+    def __init__(
+        self,
+        driver: Driver = default_driver,
+        table_prefix: str = BARRAGE_MESSAGE_TYPE,
+        config: dict = QUERY_CONFIG,
+    ):
+        self._driver = driver
+        self._table_prefix = table_prefix
+        self._default_limit = config["default_limit"]
+        self._max_limit = config["max_limit"]
+        self._cache = TTLCache(config["cache_ttl"], config["cache_rows"])
+
+        self._retry_delay = config["retry_delay"]
+        self._max_retry_delay = config["max_retry_delay"]
+
+        self._tables: Set[str] = set()  # tables known to exist
+        self._tagged: Set[str] = set()  # tables known to have a tags column
+        self._checked_at: Dict[str, float] = {}  # last tags column check
+        self._indexed: Set[str] = set()
+        self._building: Dict[str, asyncio.Task] = {}
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+
+    async def prepare(self) -> None:
+        logger.info("Creating indexes on barrage tables...")
+        for table in await self._driver.list_tables(self._table_prefix):
+            # one build at a time, tables queried meanwhile build on their own
+            task = self._schedule(table)
+            if task is not None:
+                await task
+        logger.info("Indexes created.")
+
+    async def close(self) -> None:
+        for task in list(self._building.values()):
+            task.cancel()
+
+    def _schedule(self, table: str) -> Optional[asyncio.Task]:
+        if table in self._indexed:
+            return None
+        task = self._building.get(table, None)
+        if task is None and self._retry_at.get(table, 0.0) <= time.monotonic():
+            task = asyncio.create_task(self._build(table))
+            self._building[table] = task
+        return task
+
+    async def _build(self, table: str) -> None:
+        try:
+            done = await self._driver.create_json_indexes(table)
+        finally:
+            self._building.pop(table, None)
+        if done:
+            self._indexed.add(table)
+            self._failures.pop(table, None)
+            self._retry_at.pop(table, None)
+        else:
+            failures = self._failures.get(table, 0) + 1
+            delay = min(
+                self._retry_delay * 2 ** (failures - 1), self._max_retry_delay
+            )
+            self._failures[table] = failures
+            self._retry_at[table] = time.monotonic() + delay
+            logger.warning(
+                f"Failed to create indexes on table { table }, retry in {delay}s"
+            )
+
+    async def barrages(
+        self,
+        room_id: str,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        q: Optional[str] = None,
+        cursor: Optional[str] = None,
+        limit: Optional[str] = None,
+        tag: Optional[str] = None,
+    ) -> Optional[dict]:
+        """Fetch a page of barrages ordered by (time, id).
+
+        Returns None if the room has no barrage table. Raises ValueError on
+        malformed arguments.
+        """
+        if not room_id.isalnum():
+            raise ValueError(f"invalid room id: { room_id }")
+        start_time = self._parse_time(start) if start else None
+        end_time = self._parse_time(end) if end else None
+        after = self._decode_cursor(cursor) if cursor else None
+        q = q.strip() if q else None
+        tag_id = int(tag) if tag else None
+        size = int(limit) if limit else self._default_limit
+        size = max(1, min(size, self._max_limit))
+
+        key = (room_id, start_time, end_time, q, tag_id, after, size)
+        page = self._cache.get(key)
+        if page is not None:
+            return page
+
+        table = f"{self._table_prefix}_{room_id}"
+        if table not in self._tables or self._stale(table):
+            columns = await self._driver.table_columns(table)
+            if not columns:
+                return None
+            self._tables.add(table)
+            self._checked_at[table] = time.monotonic()
+            if "tags" in columns:
+                self._tagged.add(table)
+        # queries run without index support until the build finishes
+        self._schedule(table)
+
+        # rows without timestamp cannot take part in keyset pagination
+        conds = ["time IS NOT NULL"]
+        args = []
+        if start_time is not None:
+            args.append(start_time)
+            conds.append(f"time >= ${len(args)}")
+        if end_time is not None:
+            args.append(end_time)
+            conds.append(f"time < ${len(args)}")
+        if after is not None:
+            args.extend(after)
+            conds.append(f"(time, id) > (${len(args) - 1}, ${len(args)})")
+        if q:
+            args.append(f"%{Driver.escape_like(q)}%")
+            conds.append(f"chatmsg->>'txt' ILIKE ${len(args)}")
+        tagged = table in self._tagged
+        if tag_id is not None:
+            if tagged:
+                args.append([tag_id])
+                conds.append(f"tags @> ${len(args)}::integer[]")
+            else:
+                conds.append("FALSE")
+        args.append(size)
+        query = f"""
+            SELECT id, userid, nickname, time, chatmsg,
+            {"tags" if tagged else "NULL::integer[] AS tags"} FROM "{table}"
+            WHERE {" AND ".join(conds)}
+            ORDER BY time, id LIMIT ${len(args)};
+        """
+        records = await self._driver.select(query, tuple(args))
+        if records is None:
+            raise RuntimeError(f"query failed on table { table }")
+
+        items = [dict(r) for r in records]
+        page = {
+            "room_id": room_id,
+            "items": items,
+            "next": self._encode_cursor(items[-1]["time"], items[-1]["id"])
+            if len(items) == size
+            else None,
+        }
+        self._cache.set(key, page, max(1, len(items)))
+        return page
+
+    def _stale(self, table: str) -> bool:
+        # older tables get the tags column from the manager in the background
+        if table in self._tagged:
+            return False
+        return time.monotonic() - self._checked_at.get(table, 0.0) >= self.RECHECK
+
+    @staticmethod
+    def _parse_time(s: str) -> datetime:
+        t = datetime.fromisoformat(s)
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=Driver.tz_utc_8)
+        return t
+
+    @staticmethod
+    def _encode_cursor(t: datetime, id: int) -> str:
+        return urlsafe_b64encode(f"{t.isoformat()}|{id}".encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Tuple[datetime, int]:
+        try:
+            t, id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+            return datetime.fromisoformat(t), int(id)
+        except Exception:
+            raise ValueError(f"invalid cursor: { cursor }")
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import rapidjson
+import websockets
+from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .query import QueryService
+from .stream import Hub
+from config.settings import API_CONFIG, STREAM_CONFIG
+
+logger = logging.getLogger("crawler.server")
+
+Response = Tuple[HTTPStatus, List[Tuple[str, str]], bytes]
+
+
+class Server:
+    """Local HTTP API, served by the websockets server.
+
+    Plain GET requests are answered in `process_request` before the
+    websocket handshake, so no extra web framework is needed. Only
+    `/stream` goes on to the handshake and is served by `_handler`.
+    """
+
+    def __init__(
+        self,
+        query: QueryService,
+        hub: Optional[Hub] = None,
+        config: dict = API_CONFIG,
+    ):
+        self._query = query
+        self._hub = hub
+        self._default_backfill = STREAM_CONFIG["default_backfill"]
+        self._host = config["host"]
+        self._port = config["port"]
+        self._server: Optional[websockets.WebSocketServer] = None
+        self._prepare_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        logger.info(f"Starting API server on {self._host}:{self._port}...")
+        self._server = await websockets.serve(
+            self._handler,
+            self._host,
+            self._port,
+            process_request=self._process_request,
+        )
+        self._prepare_task = asyncio.create_task(self._query.prepare())
+
+    async def stop(self) -> None:
+        if self._prepare_task is not None:
+            self._prepare_task.cancel()
+        await self._query.close()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _process_request(
+        self, path: str, request_headers
+    ) -> Optional[Response]:
+        url = urlsplit(path)
+        parts = url.path.strip("/").split("/")
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if parts == ["stream"] and self._hub is not None:
+                self._rooms(params)
+                int(params.get("backfill", 0))
+                return None  # continue websocket handshake
+            if len(parts) == 3 and parts[0] == "rooms" and parts[2] == "barrages":
+                return await self._barrages(parts[1], params)
+            return self._response(HTTPStatus.NOT_FOUND, {"error": "not found"})
+        except ValueError as ex:
+            return self._response(HTTPStatus.BAD_REQUEST, {"error": str(ex)})
+        except Exception as ex:
+            logger.exception(str(ex), exc_info=True)
+            return self._response(
+                HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "internal error"}
+            )
+
+    async def _handler(self, websocket, path: str) -> None:
+        params = {k: v[-1] for k, v in parse_qs(urlsplit(path).query).items()}
+        rooms = self._rooms(params)
+        backfill = int(params.get("backfill", self._default_backfill))
+        subscriber = self._hub.subscribe(rooms, backfill)
+        # wake up the idle loop below when the client goes away
+        watcher = asyncio.create_task(websocket.wait_closed())
+        watcher.add_done_callback(lambda _: subscriber.drop())
+        try:
+            while True:
+                msg = await subscriber.get()
+                if msg is None:
+                    if websocket.open:
+                        await websocket.close(1008, "subscriber too slow")
+                    break
+                await websocket.send(msg)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            watcher.cancel()
+            self._hub.unsubscribe(subscriber)
+
+    async def _barrages(self, room_id: str, params: Dict[str, str]) -> Response:
+        page = await self._query.barrages(
+            room_id,
+            start=params.get("start", None),
+            end=params.get("end", None),
+            q=params.get("q", None),
+            cursor=params.get("cursor", None),
+            limit=params.get("limit", None),
+            tag=params.get("tag", None),
+        )
+        if page is None:
+            return self._response(HTTPStatus.NOT_FOUND, {"error": "room not found"})
+        return self._response(HTTPStatus.OK, page)
+
+    @staticmethod
+    def _rooms(params: Dict[str, str]) -> List[str]:
+        rooms = [r for r in params.get("rooms", "").split(",") if r]
+        if not rooms:
+            raise ValueError("no rooms to subscribe")
+        return rooms
+
+    @staticmethod
+    def _response(status: HTTPStatus, data: dict) -> Response:
+        body = rapidjson.dumps(
+            data, datetime_mode=rapidjson.DM_ISO8601, ensure_ascii=False
+        ).encode("utf-8")
+        headers = [
+            ("Content-Type", "application/json; charset=utf-8"),
+            ("Content-Length", str(len(body))),
+            ("Connection", "close"),
+        ]
+        return status, headers, body
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import rapidjson
+from collections import defaultdict, deque
+from heapq import merge
+from itertools import count
+from typing import Deque, Dict, Iterable, Optional, Set, Tuple
+
+from config.settings import STREAM_CONFIG
+
+logger = logging.getLogger("crawler.stream")
+
+
+class Subscriber:
+    def __init__(self, rooms: Iterable[str], queue_size: int):
+        self.rooms = set(rooms)
+        self.dropped = False
+        self._queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(queue_size)
+
+    def put(self, msg: str) -> bool:
+        try:
+            self._queue.put_nowait(msg)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def drop(self) -> None:
+        # make room for the sentinel, pending messages are discarded anyway
+        self.dropped = True
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        self._queue.put_nowait(None)
+
+    async def get(self) -> Optional[str]:
+        """Next encoded message, None once the subscriber has been dropped."""
+        return await self._queue.get()
+
+
+class Hub:
+    """Per-room ring buffers of recent messages with live fan-out.
+
+    `publish` never waits: a subscriber whose queue is full is dropped
+    instead of slowing down ingestion.
+    """
+
+    def __init__(self, config: dict = STREAM_CONFIG):
+        self._buffer_size = config["buffer_size"]
+        self._queue_size = config["queue_size"]
+        # messages are kept with a hub-wide sequence number,
+        # so backfill of several rooms can be merged in arrival order
+        self._seq = count()
+        self._buffers: Dict[str, Deque[Tuple[int, str]]] = defaultdict(
+            lambda: deque(maxlen=self._buffer_size)
+        )
+        self._subscribers: Dict[str, Set[Subscriber]] = defaultdict(set)
+
+    def publish(self, room_id: str, msgs: Iterable[dict]) -> None:
+        encoded = [self._encode(room_id, m) for m in msgs]
+        self._buffers[room_id].extend(zip(self._seq, encoded))
+        subscribers = self._subscribers.get(room_id, None)
+        if not subscribers:
+            return
+        for subscriber in list(subscribers):
+            for msg in encoded:
+                if not subscriber.put(msg):
+                    logger.warning(f"Dropping slow subscriber. Room ID {room_id}")
+                    self.unsubscribe(subscriber)
+                    subscriber.drop()
+                    break
+
+    def subscribe(self, rooms: Iterable[str], backfill: int = 0) -> Subscriber:
+        subscriber = Subscriber(rooms, self._queue_size)
+        # backfill and registration happen without yielding,
+        # so no message is lost or duplicated in between.
+        # backfill of all rooms shares the queue, keep half of it for live ones
+        backfill = min(backfill, self._queue_size // 2)
+        if backfill > 0:
+            tails = [
+                list(self._buffers[room_id])[-backfill:]
+                for room_id in subscriber.rooms
+                if room_id in self._buffers
+            ]
+            for _, msg in list(merge(*tails))[-backfill:]:
+                subscriber.put(msg)
+        for room_id in subscriber.rooms:
+            self._subscribers[room_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        for room_id in subscriber.rooms:
+            subscribers = self._subscribers.get(room_id, None)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self._subscribers[room_id]
+
+    def clear(self, room_id: str) -> None:
+        self._buffers.pop(room_id, None)
+
+    @staticmethod
+    def _encode(room_id: str, msg: dict) -> str:
+        return rapidjson.dumps({"room_id": room_id, "data": msg}, ensure_ascii=False)
+
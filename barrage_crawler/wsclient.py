@@ -1,35 +1,184 @@
 import websockets
 import asyncio
 import logging
-from random import randint
+import time
+from random import choices
 from typing import Optional
 
+from config.settings import ENDPOINT_CONFIG
+
 logger = logging.getLogger("crawler.wsclient")
 
 
+class Endpoint:
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.latency: Optional[float] = None  # handshake seconds, moving average
+        self.failure_rate = 0.0  # share of failed handshakes, moving average
+        self.disconnect_rate = 0.0  # share of dropped sessions, moving average
+        self.failures = 0  # consecutive failed handshakes
+        self.failed_at = 0.0  # last counted failure
+        self.cooldown_until = 0.0
+        self.probe_until = 0.0  # a probe connection is in flight until then
+        self.updated = time.monotonic()  # last decay of the rates
+
+    def __repr__(self) -> str:
+        return (
+            f"<Endpoint {self.uri} latency={self.latency} "
+            f"failure_rate={self.failure_rate:.2f} "
+            f"disconnect_rate={self.disconnect_rate:.2f}>"
+        )
+
+
+class EndpointPool:
+    """Danmu endpoints shared by all clients, ranked by observed health.
+
+    An endpoint scores its handshake latency plus a timeout's worth of
+    penalty per failure and dropped session, and is picked with a weight
+    of 1 / score ** 2; untried endpoints score 0 so they get measured
+    first. Failing endpoints are skipped for an exponentially growing
+    cooldown, then probed with a single connection. Failure and
+    disconnect rates decay over time, so old trouble is forgotten.
+    When nothing can be tried, acquire() returns None and callers back
+    off for retry_after() seconds.
+    """
+
+    MIN_SCORE = 0.001
+
+    def __init__(self, config: dict = ENDPOINT_CONFIG):
+        for uri in config["uris"]:
+            websockets.uri.parse_uri(uri)  # raises InvalidURI
+        if not config["uris"]:
+            raise ValueError("no danmu endpoints configured")
+        self.endpoints = [Endpoint(uri) for uri in config["uris"]]
+        self.open_timeout = config["open_timeout"]
+        self._cooldown = config["cooldown"]
+        self._max_cooldown = config["max_cooldown"]
+        self._alpha = config["alpha"]
+        self._half_life = config["half_life"]
+
+    def score(self, endpoint: Endpoint) -> float:
+        self._decay(endpoint)
+        return (endpoint.latency or 0.0) + self.open_timeout * (
+            endpoint.failure_rate + endpoint.disconnect_rate
+        )
+
+    def acquire(self) -> Optional[Endpoint]:
+        now = time.monotonic()
+        available = [e for e in self.endpoints if self._ready_at(e) <= now]
+        if not available:
+            return None
+        # give an endpoint out of cooldown one connection to prove itself
+        for endpoint in available:
+            if endpoint.failures:
+                endpoint.probe_until = now + self.open_timeout
+                return endpoint
+        # spread connections, in favour of the better endpoints
+        weights = [max(self.score(e), self.MIN_SCORE) ** -2 for e in available]
+        return choices(available, weights)[0]
+
+    def retry_after(self) -> float:
+        """Seconds until acquire() can return an endpoint again."""
+        ready_at = min(map(self._ready_at, self.endpoints))
+        return max(ready_at - time.monotonic(), 0.0)
+
+    def record_success(self, endpoint: Endpoint, latency: float) -> None:
+        self._decay(endpoint)
+        if endpoint.latency is None:
+            endpoint.latency = latency
+        else:
+            endpoint.latency = self._average(endpoint.latency, latency)
+        endpoint.failure_rate = self._average(endpoint.failure_rate, 0.0)
+        endpoint.failures = 0
+        endpoint.cooldown_until = 0.0
+        endpoint.probe_until = 0.0
+
+    def record_failure(self, endpoint: Endpoint, started: float) -> None:
+        self._decay(endpoint)
+        endpoint.failure_rate = self._average(endpoint.failure_rate, 1.0)
+        if started < endpoint.failed_at:
+            # in flight when an earlier failure started the cooldown
+            return
+        endpoint.failures += 1
+        endpoint.failed_at = time.monotonic()
+        cooldown = min(
+            self._cooldown * 2 ** (endpoint.failures - 1), self._max_cooldown
+        )
+        endpoint.cooldown_until = endpoint.failed_at + cooldown
+        endpoint.probe_until = 0.0
+        logger.warning(f"Endpoint {endpoint.uri} failed, cooling down {cooldown}s")
+
+    def record_session(self, endpoint: Endpoint, dropped: bool) -> None:
+        self._decay(endpoint)
+        endpoint.disconnect_rate = self._average(
+            endpoint.disconnect_rate, 1.0 if dropped else 0.0
+        )
+
+    @staticmethod
+    def _ready_at(endpoint: Endpoint) -> float:
+        if endpoint.failures:
+            # cooling down, or a probe is in flight
+            return max(endpoint.cooldown_until, endpoint.probe_until)
+        return 0.0
+
+    def _average(self, average: float, sample: float) -> float:
+        return average + self._alpha * (sample - average)
+
+    def _decay(self, endpoint: Endpoint) -> None:
+        now = time.monotonic()
+        factor = 0.5 ** ((now - endpoint.updated) / self._half_life)
+        endpoint.failure_rate *= factor
+        endpoint.disconnect_rate *= factor
+        endpoint.updated = now
+
+
+default_pool = EndpointPool()
+
+
 class Client:
     DY_MAX_FRAME_SIZE = 2 ** 14
     ConnectionClosedOK = websockets.exceptions.ConnectionClosedOK
 
-    def __init__(self):
-        self.uri = f"wss://danmuproxy.douyu.com:{randint(8502,8506)}/"
+    def __init__(self, pool: EndpointPool = default_pool):
+        self.uri: Optional[str] = None
+        self._pool = pool
+        self._endpoint: Optional[Endpoint] = None
+        self._dropped = False
         self._wsclient = None
         self._buffer = []
 
     async def open(self) -> bool:
+        endpoint = self._pool.acquire()
+        if endpoint is None:
+            # every endpoint is cooling down, see retry_after()
+            return False
+        self.uri = endpoint.uri
+        start = time.monotonic()
         try:
             # set ping_interval with None to prevent unexpected disconnection
-            self._wsclient = await websockets.connect(
-                self.uri, ping_interval=None
+            self._wsclient = await asyncio.wait_for(
+                websockets.connect(self.uri, ping_interval=None),
+                self._pool.open_timeout,
             )
-            return True
-        except (websockets.InvalidHandshake, asyncio.TimeoutError) as ex:
+        except (websockets.InvalidHandshake, asyncio.TimeoutError, OSError) as ex:
             logging.exception(str(ex), exc_info=True)
+            self._pool.record_failure(endpoint, start)
             return False
+        else:
+            self._pool.record_success(endpoint, time.monotonic() - start)
+            self._endpoint = endpoint
+            self._dropped = False
+            return True
+
+    def retry_after(self) -> float:
+        return self._pool.retry_after()
 
     async def close(self) -> bool:
         if self._wsclient is not None:
             await self._wsclient.close()
+        if self._endpoint is not None:
+            self._pool.record_session(self._endpoint, self._dropped)
+            self._endpoint = None
         return True
 
     async def recv(self) -> Optional[bytes]:
@@ -47,10 +196,10 @@ class Client:
             except (RuntimeError, asyncio.TimeoutError,) as ex:
                 logging.exception(str(ex), exc_info=True)
                 return None
-            except (
-                asyncio.CancelledError,
-                websockets.exceptions.ConnectionClosedError,
-            ):
+            except asyncio.CancelledError:
+                return None
+            except websockets.exceptions.ConnectionClosedError:
+                self._dropped = True
                 return None
         return None
 
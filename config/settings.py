@@ -16,6 +16,51 @@ POSTGRES = {
     "port": os.getenv("DB_PORT", "5432"),
 }
 
+DANMU_ENDPOINTS = [
+    uri.strip()
+    for uri in os.getenv(
+        "DANMU_ENDPOINTS",
+        ",".join(f"wss://danmuproxy.douyu.com:{port}/" for port in range(8502, 8507)),
+    ).split(",")
+    if uri.strip()
+]
+
+ENDPOINT_CONFIG = {
+    "uris": DANMU_ENDPOINTS,
+    "open_timeout": 10.0,  # seconds
+    "cooldown": 10.0,  # seconds, doubled on every consecutive failure
+    "max_cooldown": 300.0,
+    "alpha": 0.3,  # weight of the latest sample in moving averages
+    "half_life": 300.0,  # seconds for failure and disconnect rates to halve
+}
+
+API_CONFIG = {
+    "host": os.getenv("API_HOST", "127.0.0.1"),
+    "port": int(os.getenv("API_PORT", "8080")),
+}
+
+QUERY_CONFIG = {
+    "cache_ttl": 2.0,  # seconds
+    "cache_rows": 20000,  # total rows over all cached pages
+    "default_limit": 100,
+    "max_limit": 500,
+    "retry_delay": 60.0,  # seconds before retrying a failed index build, doubled
+    "max_retry_delay": 3600.0,
+}
+
+STREAM_CONFIG = {
+    "buffer_size": 1000,  # recent messages kept per room
+    "queue_size": 1000,  # pending messages per subscriber before dropping it
+    "default_backfill": 100,
+}
+
+KEYWORD_CONFIG = {
+    "path": os.getenv(
+        "KEYWORD_FILE", os.path.join(os.path.dirname(__file__), "keywords.txt")
+    ),
+    "max_patterns": 32,  # re: entries are scanned one by one, keep them few
+}
+
 try:
     from .settings.local import *  # noqa
 except ImportError:
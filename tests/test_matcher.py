@@ -0,0 +1,121 @@
+import os
+import random
+import tempfile
+import unittest
+
+from barrage_crawler.matcher import Automaton, Matcher
+
+
+class AutomatonTest(unittest.TestCase):
+    def test_overlapping_keywords(self):
+        automaton = Automaton([(1, "he"), (2, "she"), (3, "his"), (4, "hers")])
+
+        self.assertEqual(automaton.match("ushers"), {1, 2, 4})
+        self.assertEqual(automaton.match("UsHeRs"), {1, 2, 4})
+        self.assertEqual(automaton.match("xyz"), set())
+
+    def test_matches_brute_force(self):
+        rng = random.Random(0)
+        keywords = [
+            (i, "".join(rng.choice("abcd") for _ in range(rng.randint(1, 5))))
+            for i in range(500)
+        ]
+        automaton = Automaton(keywords)
+        for _ in range(200):
+            text = "".join(rng.choice("abcde") for _ in range(rng.randint(0, 30)))
+            expected = {i for i, word in keywords if word in text}
+            self.assertEqual(automaton.match(text), expected, text)
+
+
+class MatcherLoadTest(unittest.TestCase):
+    def load(self, content: str, max_patterns: int = 32) -> Matcher:
+        fd, path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        matcher = Matcher(dict(path=path, max_patterns=max_patterns))
+        matcher._automaton, matcher._patterns = matcher._load()
+        return matcher
+
+    def test_parses_keywords_and_patterns(self):
+        with self.assertLogs("crawler.matcher", "WARNING") as logs:
+            matcher = self.load(
+                "# comment\n"
+                "\n"
+                "1\t666\n"
+                "2\tre:^\\d{6,}$\n"
+                "3\tre:(\n"
+                "x\tbad id\n"
+                "no tab\n"
+                "4\tHello World\n"
+            )
+        self.assertEqual(len(logs.records), 3)
+
+        self.assertEqual(matcher.tag({"txt": "123456"}), [2])
+        self.assertEqual(matcher.tag({"txt": "6666"}), [1])
+        self.assertEqual(matcher.tag({"txt": "hello world!"}), [4])
+        self.assertEqual(matcher.tag({"txt": "bad id"}), None)
+        self.assertEqual(matcher.tag({"txt": {"not": "text"}}), None)
+        self.assertEqual(matcher.tag({}), None)
+
+    def test_patterns_are_capped(self):
+        with self.assertLogs("crawler.matcher", "WARNING"):
+            matcher = self.load(
+                "1\tre:a\n2\tre:b\n3\tre:c\n4\tc\n", max_patterns=2
+            )
+
+        self.assertEqual(matcher.tag({"txt": "abc"}), [1, 2, 4])
+
+
+class MatcherReloadTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".txt")
+        os.close(fd)
+        self.matcher = Matcher(dict(path=self.path, max_patterns=32))
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def write(self, content: bytes, mtime: float) -> None:
+        with open(self.path, "wb") as f:
+            f.write(content)
+        os.utime(self.path, (mtime, mtime))
+
+    async def test_reload_only_on_change(self):
+        self.write(b"1\t666\n", mtime=1000)
+
+        self.assertTrue(await self.matcher.reload())
+        self.assertFalse(await self.matcher.reload())
+        self.assertEqual(self.matcher.tag({"txt": "6666"}), [1])
+
+        self.write(b"2\t888\n", mtime=2000)
+        self.assertTrue(await self.matcher.reload())
+        self.assertEqual(self.matcher.tag({"txt": "6666"}), None)
+        self.assertEqual(self.matcher.tag({"txt": "888"}), [2])
+
+    async def test_bad_file_keeps_previous_keywords(self):
+        self.write(b"1\t666\n", mtime=1000)
+        await self.matcher.reload()
+
+        self.write(b"2\t\xff\n", mtime=2000)
+        with self.assertLogs("crawler.matcher", "ERROR"):
+            self.assertFalse(await self.matcher.reload())
+        self.assertEqual(self.matcher.tag({"txt": "666"}), [1])
+
+        # retried until the file is fixed
+        self.write(b"2\t888\n", mtime=2000)
+        self.assertTrue(await self.matcher.reload())
+        self.assertEqual(self.matcher.tag({"txt": "888"}), [2])
+
+    async def test_removed_file_clears_keywords(self):
+        self.write(b"1\t666\n", mtime=1000)
+        await self.matcher.reload()
+
+        os.remove(self.path)
+        self.assertTrue(await self.matcher.reload())
+        self.assertEqual(self.matcher.tag({"txt": "666"}), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
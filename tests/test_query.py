@@ -0,0 +1,269 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from http import HTTPStatus
+from unittest import mock
+
+import rapidjson
+
+from barrage_crawler.driver import Driver
+from barrage_crawler.query import QueryService, TTLCache
+from barrage_crawler.server import Server
+
+CONFIG = dict(
+    cache_ttl=2.0,
+    cache_rows=100,
+    default_limit=2,
+    max_limit=10,
+    retry_delay=60.0,
+    max_retry_delay=3600.0,
+)
+T0 = datetime(2021, 1, 1, 20, tzinfo=timezone(timedelta(hours=8)))
+
+
+class FakeDriver:
+    def __init__(self, columns=("id", "time", "chatmsg", "tags"), rows=()):
+        self.columns = set(columns)
+        self.rows = list(rows)
+        self.queries = []
+
+    async def table_columns(self, table):
+        return self.columns
+
+    async def list_tables(self, prefix):
+        return []
+
+    async def create_json_indexes(self, table):
+        return True
+
+    async def select(self, query, args, single=False):
+        self.queries.append((" ".join(query.split()), args))
+        return self.rows
+
+
+def _row(id: int) -> dict:
+    return dict(
+        id=id,
+        userid="1",
+        nickname="n",
+        time=T0 + timedelta(seconds=id),
+        chatmsg={"txt": str(id)},
+        tags=None,
+    )
+
+
+class FakePool:
+    def __init__(self, indisvalid):
+        self.indisvalid = indisvalid
+        self.executed = []
+
+    async def fetchrow(self, query, *args):
+        if self.indisvalid is None:
+            return None
+        return {"indisvalid": self.indisvalid}
+
+    async def execute(self, query, *args):
+        self.executed.append(" ".join(query.split()))
+
+
+class CreateIndexTest(unittest.IsolatedAsyncioTestCase):
+    async def create(self, indisvalid):
+        driver = Driver({})
+        driver._pool = FakePool(indisvalid)
+        self.assertTrue(await driver.create_index("idx", '"t" (time, id)'))
+        return driver._pool.executed
+
+    async def test_invalid_index_is_rebuilt(self):
+        with self.assertLogs("crawler.driver", "WARNING"):
+            executed = await self.create(indisvalid=False)
+        self.assertEqual(
+            executed,
+            [
+                'DROP INDEX CONCURRENTLY IF EXISTS "idx";',
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS "idx" ON "t" (time, id);',
+            ],
+        )
+
+    async def test_valid_or_missing_index_is_not_dropped(self):
+        for indisvalid in (True, None):
+            executed = await self.create(indisvalid)
+            self.assertEqual(len(executed), 1)
+            self.assertTrue(executed[0].startswith("CREATE INDEX"))
+
+
+class ParseTest(unittest.TestCase):
+    def test_cursor_round_trip(self):
+        cursor = QueryService._encode_cursor(T0, 42)
+        self.assertEqual(QueryService._decode_cursor(cursor), (T0, 42))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            QueryService._decode_cursor("not a cursor")
+
+    def test_naive_time_is_utc_8(self):
+        t = QueryService._parse_time("2021-01-01T20:00:00")
+        self.assertEqual(t, T0)
+        t = QueryService._parse_time("2021-01-01T12:00:00+00:00")
+        self.assertEqual(t, T0)
+        with self.assertRaises(ValueError):
+            QueryService._parse_time("yesterday")
+
+
+class TTLCacheTest(unittest.TestCase):
+    def test_expiry(self):
+        cache = TTLCache(ttl=2.0, maxweight=10)
+        with mock.patch("barrage_crawler.query.time.monotonic") as now:
+            now.return_value = 100.0
+            cache.set("a", 1)
+            self.assertEqual(cache.get("a"), 1)
+            now.return_value = 103.0
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(len(cache), 0)
+
+    def test_expired_entries_are_removed_on_set(self):
+        cache = TTLCache(ttl=2.0, maxweight=10)
+        with mock.patch("barrage_crawler.query.time.monotonic") as now:
+            now.return_value = 100.0
+            cache.set("a", 1)
+            cache.set("b", 2)
+            now.return_value = 103.0
+            cache.set("c", 3)
+        self.assertEqual(len(cache), 1)
+
+    def test_evicts_oldest_by_weight(self):
+        cache = TTLCache(ttl=2.0, maxweight=10)
+        cache.set("a", 1, weight=4)
+        cache.set("b", 2, weight=4)
+        cache.set("c", 3, weight=4)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.get("b"), 2)
+        self.assertEqual(cache.get("c"), 3)
+
+        cache.set("b", 4, weight=2)
+        self.assertEqual(cache.get("b"), 4)
+        cache.set("huge", 5, weight=11)
+        self.assertIsNone(cache.get("huge"))
+        self.assertEqual(len(cache), 2)
+
+
+class QueryServiceTest(unittest.IsolatedAsyncioTestCase):
+    async def query(self, driver=None, **kw):
+        self.driver = driver or FakeDriver()
+        service = QueryService(self.driver, config=CONFIG)
+        page = await service.barrages("9999", **kw)
+        return page, self.driver.queries[-1] if self.driver.queries else None
+
+    async def test_no_filters(self):
+        _, (sql, args) = await self.query()
+        self.assertIn('FROM "chatmsg_9999" WHERE time IS NOT NULL ORDER', sql)
+        self.assertIn("LIMIT $1", sql)
+        self.assertEqual(args, (2,))
+
+    async def test_time_range_and_cursor(self):
+        cursor = QueryService._encode_cursor(T0, 7)
+        _, (sql, args) = await self.query(
+            start="2021-01-01T20:00:00", end="2021-01-01T21:00:00", cursor=cursor
+        )
+        self.assertIn("time >= $1 AND time < $2 AND (time, id) > ($3, $4)", sql)
+        self.assertEqual(args, (T0, T0 + timedelta(hours=1), T0, 7, 2))
+
+    async def test_text_search_escapes_like(self):
+        _, (sql, args) = await self.query(q=" 50%_off ")
+        self.assertIn("chatmsg->>'txt' ILIKE $1", sql)
+        self.assertEqual(args[0], "%50\\%\\_off%")
+
+    async def test_tag_filter(self):
+        _, (sql, args) = await self.query(tag="3")
+        self.assertIn("chatmsg, tags FROM", sql)
+        self.assertIn("tags @> $1::integer[]", sql)
+        self.assertEqual(args, ([3], 2))
+
+    async def test_tag_filter_on_untagged_table(self):
+        driver = FakeDriver(columns=("id", "time", "chatmsg"))
+        _, (sql, args) = await self.query(driver, tag="3")
+        self.assertIn("NULL::integer[] AS tags", sql)
+        self.assertIn("AND FALSE", sql)
+        self.assertEqual(args, (2,))
+
+    async def test_tags_column_is_rechecked(self):
+        driver = FakeDriver(columns=("id", "time", "chatmsg"))
+        service = QueryService(driver, config=CONFIG)
+        with mock.patch("barrage_crawler.query.time.monotonic") as now:
+            now.return_value = 100.0
+            await service.barrages("9999", tag="3")
+            # the worker adds the column in the background
+            driver.columns.add("tags")
+            await service.barrages("9999", tag="4")
+            self.assertIn("AND FALSE", driver.queries[-1][0])
+
+            now.return_value = 100.0 + QueryService.RECHECK
+            await service.barrages("9999", tag="5")
+        self.assertIn("tags @> $1::integer[]", driver.queries[-1][0])
+        self.assertEqual(service._tagged, {"chatmsg_9999"})
+
+    async def test_limit_is_clamped(self):
+        _, (_, args) = await self.query(limit="1000")
+        self.assertEqual(args, (10,))
+        _, (_, args) = await self.query(limit="0")
+        self.assertEqual(args, (1,))
+
+    async def test_next_cursor_only_on_full_page(self):
+        page, _ = await self.query(driver=FakeDriver(rows=[_row(1), _row(2)]))
+        self.assertEqual(
+            QueryService._decode_cursor(page["next"]), (_row(2)["time"], 2)
+        )
+        page, _ = await self.query(driver=FakeDriver(rows=[_row(1)]))
+        self.assertIsNone(page["next"])
+
+    async def test_pages_are_cached(self):
+        service = QueryService(FakeDriver(rows=[_row(1)]), config=CONFIG)
+        first = await service.barrages("9999", q="a")
+        second = await service.barrages("9999", q="a")
+        await service.barrages("9999", q="b")
+        self.assertIs(first, second)
+        self.assertEqual(len(service._driver.queries), 2)
+
+    async def test_missing_table(self):
+        page, query = await self.query(driver=FakeDriver(columns=()))
+        self.assertIsNone(page)
+        self.assertIsNone(query)
+
+    async def test_invalid_room_id(self):
+        service = QueryService(FakeDriver(), config=CONFIG)
+        with self.assertRaises(ValueError):
+            await service.barrages("1; DROP")
+
+
+class ServerRoutingTest(unittest.IsolatedAsyncioTestCase):
+    async def request(self, path, driver=None):
+        server = Server(QueryService(driver or FakeDriver(), config=CONFIG))
+        status, headers, body = await server._process_request(path, {})
+        return status, rapidjson.loads(body)
+
+    async def test_barrages(self):
+        status, body = await self.request(
+            "/rooms/9999/barrages?q=a", FakeDriver(rows=[_row(1)])
+        )
+        self.assertEqual(status, HTTPStatus.OK)
+        self.assertEqual(body["items"][0]["chatmsg"], {"txt": "1"})
+        self.assertIsNone(body["next"])
+
+    async def test_bad_request(self):
+        for path in (
+            "/rooms/9999/barrages?limit=x",
+            "/rooms/9999/barrages?start=yesterday",
+            "/rooms/9999/barrages?cursor=x",
+            "/rooms/99-99/barrages",
+        ):
+            status, _ = await self.request(path)
+            self.assertEqual(status, HTTPStatus.BAD_REQUEST, path)
+
+    async def test_not_found(self):
+        status, body = await self.request("/rooms/9999/barrages", FakeDriver(()))
+        self.assertEqual(status, HTTPStatus.NOT_FOUND)
+        self.assertEqual(body["error"], "room not found")
+        status, _ = await self.request("/nothing")
+        self.assertEqual(status, HTTPStatus.NOT_FOUND)
+
+
+if __name__ == "__main__":
+    unittest.main()
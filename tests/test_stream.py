@@ -0,0 +1,75 @@
+import unittest
+from http import HTTPStatus
+
+import rapidjson
+
+from barrage_crawler.query import QueryService
+from barrage_crawler.server import Server
+from barrage_crawler.stream import Hub
+
+
+def _config(queue_size: int) -> dict:
+    return dict(buffer_size=10, queue_size=queue_size, default_backfill=3)
+
+
+def _drain(subscriber) -> list:
+    msgs = []
+    while not subscriber._queue.empty():
+        msg = subscriber._queue.get_nowait()
+        msgs.append(msg and rapidjson.loads(msg))
+    return msgs
+
+
+class HubTest(unittest.IsolatedAsyncioTestCase):
+    async def test_backfill_merges_rooms_in_arrival_order(self):
+        hub = Hub(_config(queue_size=10))
+        hub.publish("1", [{"txt": "a"}])
+        hub.publish("2", [{"txt": "b"}, {"txt": "c"}])
+        hub.publish("1", [{"txt": "d"}])
+
+        subscriber = hub.subscribe(["1", "2"], backfill=3)
+
+        self.assertEqual(
+            [(m["room_id"], m["data"]["txt"]) for m in _drain(subscriber)],
+            [("2", "b"), ("2", "c"), ("1", "d")],
+        )
+
+    async def test_backfill_leaves_room_for_live_messages(self):
+        hub = Hub(_config(queue_size=3))
+        for room_id in ("1", "2"):
+            hub.publish(room_id, [{"txt": str(i)} for i in range(3)])
+
+        subscriber = hub.subscribe(["1", "2"], backfill=3)
+        hub.publish("1", [{"txt": "live"}])
+
+        self.assertFalse(subscriber.dropped)
+        self.assertEqual(_drain(subscriber)[-1]["data"]["txt"], "live")
+
+    async def test_slow_subscriber_is_dropped(self):
+        hub = Hub(_config(queue_size=2))
+        subscriber = hub.subscribe(["1"])
+
+        hub.publish("1", [{"txt": str(i)} for i in range(3)])
+
+        self.assertTrue(subscriber.dropped)
+        self.assertEqual(_drain(subscriber), [None])
+        hub.publish("1", [{"txt": "after"}])
+        self.assertEqual(_drain(subscriber), [])
+
+
+class StreamRoutingTest(unittest.IsolatedAsyncioTestCase):
+    async def test_rooms_are_validated(self):
+        server = Server(QueryService(), hub=Hub(_config(queue_size=10)))
+        for path in (
+            "/stream",
+            "/stream?rooms=",
+            "/stream?rooms=,",
+            "/stream?rooms=1&backfill=x",
+        ):
+            response = await server._process_request(path, {})
+            self.assertEqual(response[0], HTTPStatus.BAD_REQUEST, path)
+        self.assertIsNone(await server._process_request("/stream?rooms=1,,2", {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+from unittest import mock
+
+from barrage_crawler.crawler import RoomClient
+from barrage_crawler.manager import Manager
+from barrage_crawler.matcher import Automaton, Matcher
+from barrage_crawler.sttutil import STTUtil
+
+
+class FakeDriver:
+    def __init__(self, tables=(), columns=("tags",)):
+        self.tables = list(tables)
+        self.columns = set(columns)
+        self.fail_column = set()
+        self.fail_index = set()
+        self.altered = []
+        self.indexed = []
+        self.saved = []
+
+    async def list_tables(self, prefix):
+        return self.tables
+
+    async def add_tags_column(self, table):
+        if table in self.fail_column:
+            return False
+        self.altered.append(table)
+        return True
+
+    async def create_tags_index(self, table):
+        if table in self.fail_index:
+            return False
+        self.indexed.append(table)
+        return True
+
+    async def create_json_table(self, table):
+        return True
+
+    async def table_columns(self, table):
+        return self.columns
+
+    async def save_jsons(self, datas, table, tags=None):
+        self.saved.append((table, tags))
+
+
+class FakeWSClient:
+    def __init__(self, room, frames):
+        self._room = room
+        self._frames = list(frames)
+
+    async def recv(self):
+        frame = self._frames.pop(0)
+        if not self._frames:
+            self._room.pause()
+        return frame
+
+    async def send(self, message):
+        return True
+
+
+def _frame(txt: str) -> bytes:
+    msg = STTUtil.stt_render(
+        {"type": "chatmsg", "txt": txt, "uid": "1", "nn": "n", "cst": "1609502400"}
+    )
+    return STTUtil.pack(msg)
+
+
+def _matcher() -> Matcher:
+    matcher = Matcher(dict(path="", max_patterns=0))
+    matcher._automaton = Automaton([(1, "666")])
+    return matcher
+
+
+class UpgradeTablesTest(unittest.IsolatedAsyncioTestCase):
+    async def test_column_and_index_are_recorded_separately(self):
+        driver = FakeDriver(tables=["chatmsg_1", "chatmsg_2", "chatmsg_3"])
+        driver.fail_column.add("chatmsg_2")
+        driver.fail_index.add("chatmsg_3")
+        manager = Manager("room", driver=driver, matcher=_matcher())
+
+        await manager._upgrade_tables()
+        self.assertEqual(manager._tagged, {"chatmsg_1", "chatmsg_3"})
+        self.assertEqual(manager._tags_indexed, {"chatmsg_1"})
+
+        # failures are retried, finished tables are left alone
+        driver.fail_column.clear()
+        driver.fail_index.clear()
+        await manager._upgrade_tables()
+        self.assertEqual(driver.altered, ["chatmsg_1", "chatmsg_3", "chatmsg_2"])
+        self.assertEqual(driver.indexed, ["chatmsg_1", "chatmsg_2", "chatmsg_3"])
+        self.assertEqual(manager._tags_indexed, set(driver.tables))
+
+
+class RoomTaggingTest(unittest.IsolatedAsyncioTestCase):
+    async def receive(self, room, *frames):
+        room._wsclient = FakeWSClient(room, frames)
+        with mock.patch.object(room, "_logout"):
+            await room._receive_msg()
+        room.resume()
+
+    async def test_starts_tagging_once_table_is_upgraded(self):
+        driver = FakeDriver(columns=())
+        tagged = set()
+        room = RoomClient("1", driver=driver, matcher=_matcher(), tagged=tagged)
+        await room._prepare()
+
+        await self.receive(room, _frame("666"))
+        # the manager adds the column while the room stays connected
+        tagged.add("chatmsg_1")
+        await self.receive(room, _frame("666"), _frame("hi"))
+
+        self.assertEqual(
+            driver.saved,
+            [("chatmsg_1", None), ("chatmsg_1", [[1]]), ("chatmsg_1", [None])],
+        )
+
+    async def test_new_table_is_tagged_right_away(self):
+        driver = FakeDriver(columns=("tags",))
+        tagged = set()
+        room = RoomClient("1", driver=driver, matcher=_matcher(), tagged=tagged)
+        await room._prepare()
+
+        await self.receive(room, _frame("666"))
+
+        self.assertEqual(tagged, {"chatmsg_1"})
+        self.assertEqual(driver.saved, [("chatmsg_1", [[1]])])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import asyncio
+import random
+import unittest
+from collections import Counter
+from http import HTTPStatus
+
+import websockets
+
+from barrage_crawler.wsclient import Client, EndpointPool
+
+
+def _config(uris: list) -> dict:
+    return dict(
+        uris=uris,
+        open_timeout=1.0,
+        cooldown=0.2,
+        max_cooldown=1.0,
+        alpha=0.3,
+        half_life=0.1,
+    )
+
+
+def _uri(server) -> str:
+    return "ws://127.0.0.1:%d/" % server.sockets[0].getsockname()[1]
+
+
+async def _echo(websocket, path):
+    await websocket.wait_closed()
+
+
+class EndpointPoolTest(unittest.IsolatedAsyncioTestCase):
+    """Runs the pool against local stand-ins for the danmu servers."""
+
+    async def asyncSetUp(self):
+        random.seed(0)
+        self.accepting = False
+
+        async def process_request(path, request_headers):
+            if not self.accepting:
+                return HTTPStatus.SERVICE_UNAVAILABLE, [], b""
+
+        self.healthy = await websockets.serve(_echo, "127.0.0.1", 0)
+        self.flaky = await websockets.serve(
+            _echo, "127.0.0.1", 0, process_request=process_request
+        )
+        self.pool = EndpointPool(_config([_uri(self.healthy), _uri(self.flaky)]))
+        self.good, self.bad = self.pool.endpoints
+
+    async def asyncTearDown(self):
+        for server in (self.healthy, self.flaky):
+            server.close()
+            await server.wait_closed()
+
+    async def open(self) -> Client:
+        client = Client(self.pool)
+        await client.open()
+        await client.close()
+        return client
+
+    async def refusing_pool(self) -> EndpointPool:
+        port = self.flaky.sockets[0].getsockname()[1]
+        self.flaky.close()
+        await self.flaky.wait_closed()
+        return EndpointPool(_config([f"ws://127.0.0.1:{port}/"]))
+
+    def picks(self, n: int = 200) -> Counter:
+        return Counter(self.pool.acquire().uri for _ in range(n))
+
+    async def test_failing_endpoint_is_avoided_then_recovers(self):
+        # untried endpoints go first, so two connections measure both
+        with self.assertLogs("crawler.wsclient", "WARNING"):
+            await self.open()
+            await self.open()
+        self.assertEqual(self.good.failures, 0)
+        self.assertEqual(self.bad.failures, 1)
+
+        # cooling down
+        self.assertEqual(self.picks(), Counter({self.good.uri: 200}))
+
+        # cooldown over: a single probe goes to the recovered endpoint
+        self.accepting = True
+        await asyncio.sleep(0.25)
+        client = await self.open()
+        self.assertEqual(client.uri, self.bad.uri)
+        self.assertEqual(self.bad.failures, 0)
+
+        # the failure rate decays, traffic is shared again
+        await asyncio.sleep(1.0)
+        self.assertGreater(self.picks()[self.bad.uri], 40)
+
+    async def test_failed_probe_extends_cooldown(self):
+        with self.assertLogs("crawler.wsclient", "WARNING"):
+            await self.open()
+            await self.open()
+            await asyncio.sleep(0.25)
+            client = await self.open()
+        self.assertEqual(client.uri, self.bad.uri)
+        self.assertEqual(self.bad.failures, 2)
+        self.assertEqual(self.picks()[self.bad.uri], 0)
+
+    async def test_refused_connection_is_a_failure(self):
+        pool = await self.refusing_pool()
+
+        with self.assertLogs("crawler.wsclient", "WARNING"):
+            self.assertFalse(await Client(pool).open())
+        self.assertEqual(pool.endpoints[0].failures, 1)
+
+    async def test_concurrent_failures_count_once(self):
+        pool = await self.refusing_pool()
+        endpoint = pool.endpoints[0]
+
+        with self.assertLogs("crawler.wsclient", "WARNING") as logs:
+            opened = await asyncio.gather(*(Client(pool).open() for _ in range(30)))
+        self.assertFalse(any(opened))
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(endpoint.failures, 1)
+        self.assertLessEqual(pool.retry_after(), 0.2)
+        self.assertGreater(endpoint.failure_rate, 0.9)
+
+    async def test_nothing_is_acquired_while_cooling_down(self):
+        pool = await self.refusing_pool()
+        with self.assertLogs("crawler.wsclient", "WARNING"):
+            await Client(pool).open()
+
+        # returns at once instead of waiting out the cooldown
+        self.assertIsNone(pool.acquire())
+        self.assertFalse(await Client(pool).open())
+        self.assertEqual(pool.endpoints[0].failures, 1)
+
+        # after the cooldown only one probe is let through
+        await asyncio.sleep(pool.retry_after())
+        self.assertIs(pool.acquire(), pool.endpoints[0])
+        self.assertIsNone(pool.acquire())
+        self.assertAlmostEqual(pool.retry_after(), pool.open_timeout, delta=0.1)
+
+
+class EndpointConfigTest(unittest.TestCase):
+    def test_invalid_uri_is_rejected(self):
+        with self.assertRaises(websockets.InvalidURI):
+            EndpointPool(_config(["ws://127.0.0.1:9001/", ""]))
+
+    def test_empty_pool_is_rejected(self):
+        with self.assertRaises(ValueError):
+            EndpointPool(_config([]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,10 +2,20 @@ import asyncio
 import uvloop
 import logging
 from barrage_crawler.manager import Manager, create_manager
+from barrage_crawler.matcher import Matcher
+from barrage_crawler.query import QueryService
+from barrage_crawler.server import Server
+from barrage_crawler.stream import Hub
 from config.settings import ROOMS_TABLE_NAME
 
 logging.basicConfig(level=logging.INFO)
 if __name__ == "__main__":
     uvloop.install()
-    manager: Manager = create_manager(ROOMS_TABLE_NAME)
+    hub = Hub()
+    manager: Manager = create_manager(
+        ROOMS_TABLE_NAME,
+        server=Server(QueryService(), hub=hub),
+        hub=hub,
+        matcher=Matcher(),
+    )
     manager.run()